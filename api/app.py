@@ -1,12 +1,15 @@
 import os
+import sys
 import requests
+from cachetools import TTLCache
 from flask import Flask, redirect, request, session, jsonify, url_for, render_template
 from dotenv import load_dotenv
 from urllib.parse import urlencode
 import logging
-from collections import defaultdict
-import json
-import time
+import threading
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+import orjson
 
 # --- Setup ---
 logging.basicConfig(level=logging.INFO)
@@ -24,53 +27,133 @@ TOKEN_URL = "https://accounts.spotify.com/api/token"
 API_BASE_URL = "https://api.spotify.com/v1/"
 SCOPE = "user-top-read" # We only need the top tracks now
 
+# Shared session so connection pooling / keep-alive amortizes the TCP+TLS
+# handshake across the ~dozens of API calls a single analysis makes
+SESSION = requests.Session()
+SESSION.mount('https://', requests.adapters.HTTPAdapter(pool_connections=16, pool_maxsize=16))
+
+# Artist genres barely ever change, and the same artists recur across time
+# ranges and users, so cache them in-process; the TTL and size bound keep a
+# long-lived worker from serving stale data or growing without limit
+ARTIST_GENRE_CACHE = TTLCache(maxsize=10_000, ttl=86_400)
+ARTIST_GENRE_CACHE_LOCK = threading.Lock()
+
 # ===================================================================
 # INTERNAL HELPER FUNCTIONS
 # ===================================================================
 
+def _year_of(release_date):
+    # Release dates come as YYYY, YYYY-MM, or YYYY-MM-DD; slicing beats
+    # split('-') which allocates a list plus substrings per track
+    return int(release_date[:4]) if release_date[:4].isdigit() else 0
+
 def _get_api_data(endpoint, access_token, params=None):
     headers = {'Authorization': f'Bearer {access_token}'}
-    res = requests.get(API_BASE_URL + endpoint, headers=headers, params=params)
+    res = SESSION.get(API_BASE_URL + endpoint, headers=headers, params=params)
     res.raise_for_status()
-    return res.json()
+    return orjson.loads(res.content)
+
+def _get_api_data_chunked(endpoint, ids, access_token, chunk_size=50):
+    # Bulk endpoints like /artists and /tracks cap at 50 ids per call.
+    # Each chunk is an independent request, so fetch them concurrently.
+    chunks = [ids[i:i+chunk_size] for i in range(0, len(ids), chunk_size)]
+    with ThreadPoolExecutor(max_workers=8) as executor:
+        return list(executor.map(lambda chunk: _get_api_data(endpoint, access_token, {'ids': ','.join(chunk)}), chunks))
 
 def _get_artist_genres(artist_ids, access_token):
     genres_map = {}
     if not artist_ids: return genres_map
-    for i in range(0, len(artist_ids), 50):
-        chunk = artist_ids[i:i+50]
-        params = {'ids': ','.join(chunk)}
-        data = _get_api_data('artists', access_token, params=params)
+    with ARTIST_GENRE_CACHE_LOCK:
+        genres_map = {aid: ARTIST_GENRE_CACHE[aid] for aid in artist_ids if aid in ARTIST_GENRE_CACHE}
+    missing_ids = [aid for aid in artist_ids if aid not in genres_map]
+    if not missing_ids: return genres_map
+    for data in _get_api_data_chunked('artists', missing_ids, access_token):
         for artist in data.get('artists', []):
             if artist:
-                genres_map[artist['id']] = artist.get('genres', [])
+                # The same few dozen genre strings repeat across hundreds of
+                # artists; interning shares one object per distinct genre
+                genres_map[artist['id']] = [sys.intern(g) for g in artist.get('genres', [])]
+    with ARTIST_GENRE_CACHE_LOCK:
+        for aid in missing_ids:
+            if aid in genres_map:
+                ARTIST_GENRE_CACHE[aid] = genres_map[aid]
     return genres_map
 
-def _get_ai_phase_name(phase_characteristics):
+def _get_ai_phase_names(phase_chars_list):
     gemini_api_key = os.getenv("GEMINI_API_KEY")
-    fallback_name = f"Your {phase_characteristics['period']} Era"
-    if not gemini_api_key: return fallback_name
-    
+    fallback_names = [f"Your {pc['period']} Era" for pc in phase_chars_list]
+    if not gemini_api_key or not phase_chars_list: return fallback_names
+
     gemini_api_url = f"https://generativelanguage.googleapis.com/v1beta/models/gemini-2.0-flash:generateContent?key={gemini_api_key}"
+    phase_lines = "\n".join(
+        f"{i + 1}. Time Period: {pc['period']} | Top Genres: {', '.join(pc['top_genres'])} | Vibe: {'Modern' if isinstance(pc['avg_release_year'], int) and pc['avg_release_year'] > 2010 else 'Throwback'}"
+        for i, pc in enumerate(phase_chars_list)
+    )
     prompt = f"""
-You are an expert at creating cool, personal names for music phases. Your goal is to create a simple, evocative name based on the data provided. The name should be 3 to 5 words long and not include numbers.
+You are an expert at creating cool, personal names for music phases. Your goal is to create a simple, evocative name for each phase based on the data provided. Each name should be 3 to 5 words long and not include numbers.
 
-**PHASE DATA:**
-- **Time Period:** {phase_characteristics['period']}
-- **Top Genres:** {', '.join(phase_characteristics['top_genres'])}
-- **Vibe:** {'Modern' if phase_characteristics['avg_release_year'] > 2010 else 'Throwback'}
+**PHASES:**
+{phase_lines}
 
-Generate only the name, without any extra text or quotation marks.
+Return one name per phase, in the same order as the phases.
 """
-    
-    payload = {"contents": [{"role": "user", "parts": [{"text": prompt}]}]}
+
+    payload = {
+        "contents": [{"role": "user", "parts": [{"text": prompt}]}],
+        # The response schema constrains the model to a bare JSON array of
+        # names, so it emits no prose and the parse is deterministic
+        "generationConfig": {
+            "maxOutputTokens": 200,
+            "temperature": 0.9,
+            "responseMimeType": "application/json",
+            "responseSchema": {"type": "ARRAY", "items": {"type": "STRING"}}
+        }
+    }
     try:
-        response = requests.post(gemini_api_url, headers={"Content-Type": "application/json"}, data=json.dumps(payload), timeout=20)
+        response = SESSION.post(gemini_api_url, json=payload, timeout=20)
         response.raise_for_status()
-        return response.json()['candidates'][0]['content']['parts'][0]['text'].strip().replace('"', '')
+        names = orjson.loads(orjson.loads(response.content)['candidates'][0]['content']['parts'][0]['text'])
+        if len(names) != len(phase_chars_list): raise ValueError("Unexpected number of names returned")
+        return [str(name).strip() for name in names]
     except Exception as e:
         logging.error(f"AI name generation failed: {e}")
-        return fallback_name
+        return fallback_names
+
+def _analyze_range(name, term, access_token):
+    logging.info(f"Analyzing {name} ({term})...")
+    top_tracks = _get_api_data('me/top/tracks', access_token, {'limit': 50, 'time_range': term})['items']
+    if not top_tracks: return None
+
+    # Pull out just the fields we use into flat lists so the full response
+    # dicts (and everything in them we never read) can be freed right away
+    track_artist_ids = [t['artists'][0]['id'] if t.get('artists') else None for t in top_tracks]
+    release_dates = [t['album']['release_date'] if t.get('album') and t['album'].get('release_date') else '' for t in top_tracks]
+    sample_tracks = [t['name'] for t in top_tracks[:5]]
+    cover_url = top_tracks[0]['album']['images'][0]['url'] if top_tracks[0].get('album', {}).get('images') else 'https://placehold.co/128x128/121212/FFFFFF?text=?'
+    del top_tracks
+
+    genres_map = _get_artist_genres(list({aid for aid in track_artist_ids if aid}), access_token)
+
+    # Accumulate genre counts and release years in a single pass
+    genres_count = Counter()
+    year_sum, year_n = 0, 0
+    for artist_id, release_date in zip(track_artist_ids, release_dates):
+        if artist_id in genres_map:
+            genres_count.update(genres_map[artist_id])
+        year = _year_of(release_date)
+        if year:
+            year_sum += year
+            year_n += 1
+    avg_year = round(year_sum / year_n) if year_n else 'N/A'
+
+    phase_chars = {"period": name, "top_genres": [genre for genre, _ in genres_count.most_common(5)], "avg_release_year": avg_year}
+
+    return {
+        'phase_title': name,
+        'phase_chars': phase_chars,
+        'sample_tracks': sample_tracks,
+        'phase_cover_url': cover_url
+    }
 
 # ===================================================================
 # FLASK ROUTES
@@ -90,8 +173,8 @@ def callback():
     if 'error' in request.args: return render_template('login.html', error=request.args['error'])
     if 'code' in request.args:
         payload = {'grant_type': 'authorization_code', 'code': request.args['code'], 'redirect_uri': REDIRECT_URI, 'client_id': CLIENT_ID, 'client_secret': CLIENT_SECRET}
-        res = requests.post(TOKEN_URL, data=payload)
-        session['access_token'] = res.json().get('access_token')
+        res = SESSION.post(TOKEN_URL, data=payload)
+        session['access_token'] = orjson.loads(res.content).get('access_token')
         
         user_data = _get_api_data('me', session['access_token'])
         session['display_name'] = user_data.get('display_name', 'friend')
@@ -111,36 +194,17 @@ def timeline():
             'Your All-Time DNA': 'long_term'
         }
         
-        final_phases = []
-        
-        for name, term in time_ranges.items():
-            logging.info(f"Analyzing {name} ({term})...")
-            top_tracks = _get_api_data('me/top/tracks', access_token, {'limit': 50, 'time_range': term})['items']
-            if not top_tracks: continue
-
-            artist_ids = {t['artists'][0]['id'] for t in top_tracks if t.get('artists')}
-            genres_map = _get_artist_genres(list(artist_ids), access_token)
-
-            genres_count = defaultdict(int)
-            for track in top_tracks:
-                artist_id = track['artists'][0]['id'] if track.get('artists') else None
-                if artist_id in genres_map:
-                    for genre in genres_map[artist_id]:
-                        genres_count[genre] += 1
-
-            valid_years = [int(t['album']['release_date'].split('-')[0]) for t in top_tracks if t.get('album') and t['album'].get('release_date') and '-' in t['album']['release_date']]
-            avg_year = round(sum(valid_years) / len(valid_years)) if valid_years else 'N/A'
-            
-            phase_chars = {"period": name, "top_genres": sorted(genres_count, key=genres_count.get, reverse=True)[:5], "avg_release_year": avg_year}
-            ai_name = _get_ai_phase_name(phase_chars)
-
-            final_phases.append({
-                'phase_title': name,
-                'ai_phase_name': ai_name,
-                'sample_tracks': [t['name'] for t in top_tracks[:5]],
-                'phase_cover_url': top_tracks[0]['album']['images'][0]['url'] if top_tracks[0].get('album', {}).get('images') else 'https://placehold.co/128x128/121212/FFFFFF?text=?'
-            })
-            time.sleep(1) # Small delay to be nice to the APIs
+        # The three time ranges are independent, so analyze them concurrently
+        with ThreadPoolExecutor(max_workers=3) as executor:
+            futures = [executor.submit(_analyze_range, name, term, access_token) for name, term in time_ranges.items()]
+            final_phases = [f.result() for f in futures]
+        final_phases = [p for p in final_phases if p]
+
+        # Name all phases with a single Gemini call instead of one per phase
+        ai_names = _get_ai_phase_names([p['phase_chars'] for p in final_phases])
+        for phase, ai_name in zip(final_phases, ai_names):
+            phase['ai_phase_name'] = ai_name
+            del phase['phase_chars']
 
         return render_template('timeline.html', phases=final_phases, display_name=session.get('display_name'))
 